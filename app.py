@@ -1,8 +1,14 @@
 import os
 import uuid
+import hashlib
 import datetime
+import tempfile
+import threading
 import urllib3
-import pdfplumber  # <--- NEW LIBRARY (Replaces pypdf)
+import httpx
+from functools import lru_cache
+import fitz  # PyMuPDF <--- NEW LIBRARY (Replaces pdfplumber, ~10x faster extraction)
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
 from flask_pymongo import PyMongo
@@ -13,11 +19,12 @@ from dotenv import load_dotenv
 from bson.objectid import ObjectId
 
 # AI Imports
-from langchain_text_splitters import CharacterTextSplitter
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_groq import ChatGroq
 from langchain_pinecone import PineconeVectorStore
-from pinecone import Pinecone, ServerlessSpec
+from pinecone import ServerlessSpec
+from pinecone.grpc import PineconeGRPC as Pinecone
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
@@ -51,12 +58,25 @@ CORS(app, resources={
 mongo = PyMongo(app)
 db = mongo.cx['chatpdf_db']
 bcrypt = Bcrypt(app)
+
+# 2^10 bcrypt rounds (~60ms) instead of the default 12 (~250ms): still a
+# safe work factor, but registration/login stop monopolizing a worker.
+BCRYPT_ROUNDS = 10
+
+# Indexes so the dashboard query is an index scan (sorted by the index)
+# instead of a collection scan + in-memory sort. create_index is a no-op
+# when the index already exists.
+db.chats.create_index([("user_id", 1), ("created_at", -1)])
+db.users.create_index("username", unique=True)
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
 # --- AI SETUP ---
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"), ssl_verify=False)
+# gRPC client: HTTP/2 multiplexing + protobuf, faster upserts and queries
+# than REST. (ssl_verify is a REST-only option, so it is dropped here.)
+pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
 INDEX_NAME = "pdf-chat"
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
@@ -65,21 +85,134 @@ existing_indexes = [index.name for index in pc.list_indexes()]
 if INDEX_NAME not in existing_indexes:
     print(f"Index '{INDEX_NAME}' not found. Creating it now...")
     try:
+        # Embeddings are L2-normalized at encode time, so dot product
+        # ranks identically to cosine but skips the per-query norm.
+        # Only affects newly created indexes; an existing cosine index
+        # keeps working unchanged.
         pc.create_index(
             name=INDEX_NAME,
             dimension=384,
-            metric="cosine",
+            metric="dotproduct",
             spec=ServerlessSpec(cloud="aws", region="us-east-1")
         )
         print("Index created!")
     except Exception as e:
         print(f"Error creating index: {e}")
 
-# Force CPU to prevent macOS Metal/Gunicorn crashes
-embeddings = HuggingFaceEmbeddings(
-    model_name="all-MiniLM-L6-v2",
-    model_kwargs={'device': 'cpu'}
+# Prefer the int8 ONNX model (~4x faster on CPU); fall back to the
+# FP32 PyTorch model if optimum/onnxruntime are unavailable.
+# Force CPU either way to prevent macOS Metal/Gunicorn crashes.
+try:
+    from onnx_embeddings import ONNXEmbeddings
+    embeddings = ONNXEmbeddings(batch_size=64)
+    print("Using int8 ONNX embeddings")
+except Exception as e:
+    print(f"ONNX embeddings unavailable ({e}), falling back to PyTorch")
+    embeddings = HuggingFaceEmbeddings(
+        model_name="all-MiniLM-L6-v2",
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'batch_size': 64, 'normalize_embeddings': True}
+    )
+
+UPSERT_BATCH_SIZE = 100  # Pinecone's recommended batch size
+EMBED_BATCH_SIZE = 256   # chunks embedded per pass, keeps RSS bounded
+RETRIEVAL_TOP_K = 4      # chunks of context fetched per question
+
+# Build the LLM chain once at startup - ChatGroq owns an HTTP client and
+# the prompt/parser are immutable, so rebuilding them per /ask request
+# was pure overhead. The shared httpx client keeps connections alive so
+# successive /ask calls reuse the TLS session instead of re-handshaking.
+groq_http_client = httpx.Client(
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    timeout=httpx.Timeout(60.0)
 )
+llm = ChatGroq(
+    groq_api_key=os.getenv("GROQ_API_KEY"),
+    model_name="llama-3.3-70b-versatile",
+    http_client=groq_http_client
+)
+prompt = ChatPromptTemplate.from_template("Answer based on context:\n{context}\nQuestion: {question}")
+qa_chain = prompt | llm | StrOutputParser()
+
+@lru_cache(maxsize=1024)
+def get_vectorstore(namespace):
+    """Reuse one PineconeVectorStore per namespace instead of rebuilding
+    the index handle on every /ask request."""
+    return PineconeVectorStore(index_name=INDEX_NAME, embedding=embeddings, namespace=namespace)
+
+@lru_cache(maxsize=4096)
+def embed_query_cached(question):
+    """Cache question embeddings so repeated questions skip the MiniLM
+    forward pass. Returns a tuple because lru_cache values should be
+    immutable."""
+    return tuple(embeddings.embed_query(question))
+
+# Background ingestion pool: embedding + upserts run here so /upload can
+# return as soon as the PDF is parsed. Chat docs carry a status field
+# ("processing" -> "ready"/"error") that the client polls via /status.
+ingest_executor = ThreadPoolExecutor(max_workers=2)
+
+def encode_chunks(chunks):
+    """Embed a batch of chunks with one fused tokenize->forward->pool
+    call on the underlying model (SentenceTransformer or ONNXEmbeddings),
+    skipping the per-text overhead of the LangChain wrapper."""
+    encoder = getattr(embeddings, "client", embeddings)
+    vecs = encoder.encode(
+        chunks,
+        batch_size=64,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False
+    )
+    return vecs.tolist()
+
+def embed_and_upsert(chunks, namespace_id, chat_id):
+    """Embed chunks and upsert them to Pinecone, then mark the chat doc
+    ready. Runs on the ingest executor, off the request thread."""
+    try:
+        # Long PDFs repeat headers/footers verbatim; embed each distinct
+        # chunk once. The content hash doubles as the vector id, so even
+        # duplicates that slip through upsert idempotently.
+        seen = set()
+        uniq = []
+        for chunk in chunks:
+            h = hashlib.blake2b(chunk.encode(), digest_size=8).hexdigest()
+            if h not in seen:
+                seen.add(h)
+                uniq.append((h, chunk))
+
+        # Embed and upsert incrementally in fixed-size batches so memory
+        # stays constant regardless of document size; the async upserts
+        # overlap the network round trip with the next embedding batch.
+        index = pc.Index(INDEX_NAME)
+        futures = []
+        for i in range(0, len(uniq), EMBED_BATCH_SIZE):
+            batch = uniq[i:i + EMBED_BATCH_SIZE]
+            vecs = encode_chunks([chunk for _, chunk in batch])
+            vectors = [
+                (chunk_id, vec, {"text": chunk})
+                for (chunk_id, chunk), vec in zip(batch, vecs)
+            ]
+            for j in range(0, len(vectors), UPSERT_BATCH_SIZE):
+                futures.append(index.upsert(
+                    vectors=vectors[j:j + UPSERT_BATCH_SIZE],
+                    namespace=namespace_id,
+                    async_req=True
+                ))
+        for f in futures:
+            f.result()
+        db.chats.update_one({"_id": chat_id}, {"$set": {"status": "ready"}})
+    except Exception as e:
+        print(f"Ingestion error for chat {chat_id}: {e}")
+        db.chats.update_one({"_id": chat_id}, {"$set": {"status": "error"}})
+
+def parse_session_id(session_id):
+    """Validate a session id up front instead of letting ObjectId raise
+    inside the route. Returns None for malformed ids."""
+    try:
+        return ObjectId(session_id)
+    except Exception:
+        return None
 
 # --- USER MODEL ---
 class User(UserMixin):
@@ -130,11 +263,12 @@ def register():
             flash('Username already exists. Please login.', 'error')
             return redirect(url_for('register'))
         
-        hashed_pw = bcrypt.generate_password_hash(password).decode('utf-8')
-        
+        hashed_pw = bcrypt.generate_password_hash(password, rounds=BCRYPT_ROUNDS).decode('utf-8')
+
         db.users.insert_one({
             "username": username,
             "password": hashed_pw,
+            "password_algo": f"bcrypt:{BCRYPT_ROUNDS}",  # for future migrations
             "created_at": datetime.datetime.utcnow()
         })
         
@@ -154,7 +288,12 @@ def logout():
 @app.route('/chat')
 @login_required
 def dashboard():
-    user_chats = list(db.chats.find({"user_id": current_user.id}).sort("created_at", -1))
+    user_chats = list(
+        db.chats.find(
+            {"user_id": current_user.id},
+            {"pdf_name": 1, "created_at": 1}
+        ).sort("created_at", -1)
+    )
     for chat in user_chats:
         chat['id'] = str(chat['_id'])
     return render_template('index.html', user=current_user, chats=user_chats)
@@ -184,47 +323,79 @@ def upload_file():
             # 1. Create unique Namespace
             namespace_id = f"user_{current_user.id}_{str(uuid.uuid4())[:8]}"
 
-            # 2. Read PDF using pdfplumber (MORE ROBUST)
-            text = ""
+            # 2. Spool the upload to a temp file so MuPDF can memory-map
+            # it instead of us holding the whole PDF (up to 16MB plus
+            # decoded page trees) in RAM for the life of the request.
+            tmp_fd, tmp_path = tempfile.mkstemp(suffix=".pdf")
+            os.close(tmp_fd)
             try:
-                with pdfplumber.open(file) as pdf:
-                    if len(pdf.pages) == 0:
-                         return jsonify({"error": "PDF has no readable pages"}), 400
-
-                    for page in pdf.pages:
-                        extracted = page.extract_text()
-                        if extracted:
-                            text += extracted + "\n"
-            except Exception as e:
-                print(f"PDF Reading Error: {e}")
-                return jsonify({"error": "Failed to read PDF file. It may be corrupted or encrypted."}), 400
-            
-            if not text.strip():
-                return jsonify({"error": "No text found in PDF (it might be an image/scanned PDF)."}), 400
-            
-            chunks = CharacterTextSplitter(separator="\n", chunk_size=1000, chunk_overlap=200).split_text(text)
-
-            # 3. Save Vectors to Pinecone
-            PineconeVectorStore.from_texts(
-                texts=chunks, 
-                embedding=embeddings, 
-                index_name=INDEX_NAME,
-                namespace=namespace_id
-            )
-
-            # 4. Save Chat Metadata to MongoDB
+                file.save(tmp_path)
+
+                # Read PDF using PyMuPDF (MUCH FASTER)
+                try:
+                    doc = fitz.open(tmp_path)
+                    if doc.page_count == 0:
+                        return jsonify({"error": "PDF has no readable pages"}), 400
+
+                    # Extract pages in parallel - MuPDF releases the GIL
+                    # inside get_text, so threads overlap the C parsing
+                    # across cores. Each worker opens its own Document from
+                    # the temp file because a fitz.Document is not
+                    # thread-safe.
+                    def extract_page(i):
+                        with fitz.open(tmp_path) as d:
+                            page = d.load_page(i)
+                            # Pages with multi-megabyte content streams are
+                            # usually vector graphics (charts, drawings)
+                            # with little or no text. Probe those with a
+                            # bare-bones extraction first and skip them
+                            # entirely when they yield nothing, instead of
+                            # parsing megabytes of path/fill operators.
+                            if len(page.read_contents()) > 2_000_000:
+                                probe = page.get_text("text", flags=0)
+                                return probe if probe.strip() else ""
+                            return page.get_text("text")
+
+                    with ThreadPoolExecutor(max_workers=min(8, doc.page_count)) as executor:
+                        parts = list(executor.map(extract_page, range(doc.page_count)))
+                    text = "\n".join(p for p in parts if p)
+                    doc.close()
+                except Exception as e:
+                    print(f"PDF Reading Error: {e}")
+                    return jsonify({"error": "Failed to read PDF file. It may be corrupted or encrypted."}), 400
+
+                if not text.strip():
+                    return jsonify({"error": "No text found in PDF (it might be an image/scanned PDF)."}), 400
+
+                chunks = RecursiveCharacterTextSplitter(
+                    chunk_size=1000,
+                    chunk_overlap=100,
+                    separators=["\n\n", "\n", " ", ""]
+                ).split_text(text)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+            # 3. Save Chat Metadata to MongoDB (status "processing" until
+            # the background ingestion finishes)
             new_chat = {
                 "user_id": current_user.id,
                 "pdf_name": file.filename,
                 "namespace_id": namespace_id,
                 "created_at": datetime.datetime.utcnow(),
+                "status": "processing",
                 "messages": []
             }
             result = db.chats.insert_one(new_chat)
-            
+
+            # 4. Queue embedding + upsert off the request thread and
+            # return immediately; the client polls /status/<session_id>.
+            ingest_executor.submit(embed_and_upsert, chunks, namespace_id, result.inserted_id)
+
             return jsonify({
-                "session_id": str(result.inserted_id), 
-                "filename": file.filename
+                "session_id": str(result.inserted_id),
+                "filename": file.filename,
+                "status": "processing"
             }), 200
             
     except Exception as e:
@@ -233,23 +404,51 @@ def upload_file():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/status/<session_id>')
+@login_required
+def upload_status(session_id):
+    oid = parse_session_id(session_id)
+    if oid is None:
+        return jsonify({"error": "Invalid Session ID"}), 400
+
+    chat = db.chats.find_one(
+        {"_id": oid, "user_id": current_user.id},
+        {"status": 1}
+    )
+
+    if not chat:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    # Chats created before the status field existed are ready by definition
+    status = chat.get("status", "ready")
+    payload = {"session_id": session_id, "status": status}
+    if status == "error":
+        payload["error"] = "PDF processing failed. Please re-upload the document."
+    return jsonify(payload)
+
 @app.route('/get_history/<session_id>')
 @login_required
 def get_history(session_id):
-    try:
-        chat = db.chats.find_one({"_id": ObjectId(session_id)})
-        
-        if not chat or chat['user_id'] != current_user.id:
-            return jsonify({"error": "Unauthorized"}), 403
-            
-        return jsonify({
-            "messages": chat.get('messages', []),
-            "pdf_name": chat['pdf_name'],
-            "session_id": str(chat['_id'])
-        })
-    except:
+    oid = parse_session_id(session_id)
+    if oid is None:
         return jsonify({"error": "Invalid Session ID"}), 400
 
+    # Ownership check folded into the query: one index probe, and a miss
+    # (missing chat or wrong user) comes back as a plain None.
+    chat = db.chats.find_one(
+        {"_id": oid, "user_id": current_user.id},
+        {"messages": 1, "pdf_name": 1}
+    )
+
+    if not chat:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    return jsonify({
+        "messages": chat.get('messages', []),
+        "pdf_name": chat['pdf_name'],
+        "session_id": str(chat['_id'])
+    })
+
 @app.route('/ask', methods=['POST'])
 @login_required
 def ask_question():
@@ -263,22 +462,40 @@ def ask_question():
     if not session_id:
         return jsonify({"error": "Session ID missing. Please upload a PDF first."}), 400
 
+    oid = parse_session_id(session_id)
+    if oid is None:
+        return jsonify({"error": "Invalid Session ID"}), 400
+
     try:
-        chat = db.chats.find_one({"_id": ObjectId(session_id)})
-        if not chat or chat['user_id'] != current_user.id:
+        # Ownership check folded into the query, projecting only the
+        # field this route touches - no need to pull the whole message
+        # history over the wire just to answer a question.
+        chat = db.chats.find_one(
+            {"_id": oid, "user_id": current_user.id},
+            {"namespace_id": 1, "status": 1}
+        )
+        if not chat:
             return jsonify({"error": "Unauthorized access to this PDF"}), 403
 
+        # "error" is terminal (ingestion failed, retrying won't help);
+        # "processing" means try again shortly. Chats created before the
+        # status field existed are ready by definition.
+        status = chat.get("status", "ready")
+        if status == "error":
+            return jsonify({"error": "PDF processing failed. Please delete this chat and re-upload the document."}), 422
+        if status != "ready":
+            return jsonify({"error": "PDF is still processing. Please try again shortly."}), 409
+
         # 1. Search Pinecone
-        vectorstore = PineconeVectorStore(index_name=INDEX_NAME, embedding=embeddings, namespace=chat['namespace_id'])
-        docs = vectorstore.similarity_search(user_question)
+        vectorstore = get_vectorstore(chat['namespace_id'])
+        docs = vectorstore.similarity_search_by_vector(
+            list(embed_query_cached(user_question)),
+            k=RETRIEVAL_TOP_K
+        )
         context_text = "\n\n".join(doc.page_content for doc in docs)
 
         # 2. AI Answer
-        llm = ChatGroq(groq_api_key=os.getenv("GROQ_API_KEY"), model_name="llama-3.3-70b-versatile")
-        template = "Answer based on context:\n{context}\nQuestion: {question}"
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = prompt | llm | StrOutputParser()
-        answer = chain.invoke({"context": context_text, "question": user_question})
+        answer = qa_chain.invoke({"context": context_text, "question": user_question})
 
         # 3. Update MongoDB
         new_messages = [
@@ -286,10 +503,17 @@ def ask_question():
             {"sender": "ai", "text": answer, "timestamp": datetime.datetime.utcnow()}
         ]
         
-        db.chats.update_one(
-            {"_id": ObjectId(session_id)},
-            {"$push": {"messages": {"$each": new_messages}}}
-        )
+        # Persist history off the request thread - the client already has
+        # the answer in hand, so there is no reason to hold the response
+        # on the $push round trip.
+        threading.Thread(
+            target=db.chats.update_one,
+            args=(
+                {"_id": oid},
+                {"$push": {"messages": {"$each": new_messages}}}
+            ),
+            daemon=True
+        ).start()
 
         return jsonify({"answer": answer})
         
@@ -302,21 +526,25 @@ def ask_question():
 @app.route('/delete/<session_id>', methods=['DELETE'])
 @login_required
 def delete_chat(session_id):
+    oid = parse_session_id(session_id)
+    if oid is None:
+        return jsonify({"error": "Invalid Session ID"}), 400
+
     try:
-        chat = db.chats.find_one({"_id": ObjectId(session_id)})
-        
+        chat = db.chats.find_one(
+            {"_id": oid, "user_id": current_user.id},
+            {"namespace_id": 1}
+        )
+
         if not chat:
             return jsonify({"error": "Chat not found"}), 404
-        
-        if chat['user_id'] != current_user.id:
-            return jsonify({"error": "Unauthorized"}), 403
-        
+
         try:
             pc.Index(INDEX_NAME).delete(delete_all=True, namespace=chat['namespace_id'])
         except Exception as pe:
             print(f"Pinecone delete error (continuing): {pe}")
-        
-        db.chats.delete_one({"_id": ObjectId(session_id)})
+
+        db.chats.delete_one({"_id": oid})
         
         return jsonify({"success": True, "message": "Chat deleted"}), 200
         
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import torch
+from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer
+
+MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "chatpdf_onnx")
+
+
+def _prepare_quantized_model():
+    """Export MiniLM to ONNX and dynamically quantize it to int8.
+
+    Runs once and caches the result on disk; subsequent startups just
+    load the quantized model.
+    """
+    export_dir = os.path.join(CACHE_DIR, "minilm-onnx")
+    quant_dir = os.path.join(CACHE_DIR, "minilm-onnx-int8")
+
+    if not os.path.exists(os.path.join(quant_dir, "model_quantized.onnx")):
+        print("Quantizing MiniLM to int8 ONNX (one-time setup)...")
+        model = ORTModelForFeatureExtraction.from_pretrained(MODEL_ID, export=True)
+        model.save_pretrained(export_dir)
+
+        quantizer = ORTQuantizer.from_pretrained(export_dir)
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=quant_dir, quantization_config=qconfig)
+        print("Quantized model saved.")
+
+    return ORTModelForFeatureExtraction.from_pretrained(quant_dir, file_name="model_quantized.onnx")
+
+
+class ONNXEmbeddings:
+    """Int8 ONNX Runtime replacement for HuggingFaceEmbeddings.
+
+    Exposes the same embed_documents/embed_query interface LangChain
+    expects, plus a SentenceTransformer-style encode() for direct use.
+    Int8 GEMM roughly quadruples CPU throughput vs FP32 PyTorch with
+    negligible retrieval-quality loss for MiniLM.
+    """
+
+    def __init__(self, batch_size=64):
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
+        self.model = _prepare_quantized_model()
+
+    def encode(self, texts, batch_size=None, normalize_embeddings=True, **kwargs):
+        batch_size = batch_size or self.batch_size
+        outputs = []
+        for i in range(0, len(texts), batch_size):
+            batch = texts[i:i + batch_size]
+            enc = self.tokenizer(batch, padding=True, truncation=True, max_length=256, return_tensors="pt")
+            with torch.no_grad():
+                hidden = self.model(**enc).last_hidden_state
+            # Mean pooling over non-padding tokens (same as the
+            # sentence-transformers pooling head for this model)
+            mask = enc["attention_mask"].unsqueeze(-1).float()
+            emb = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+            if normalize_embeddings:
+                emb = torch.nn.functional.normalize(emb, p=2, dim=1)
+            outputs.append(emb.numpy())
+        return np.vstack(outputs)
+
+    def embed_documents(self, texts):
+        return self.encode(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()